@@ -1,13 +1,20 @@
 # app.py
 import json
 import io
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
 import numpy as np
 from scipy.optimize import linprog
+from scipy.sparse import block_diag, csr_matrix
 import plotly.express as px
 from optimizer import run_optimizer
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
 # ============================================
 # CONFIGURACIÓN DE LA PÁGINA
 # ============================================
@@ -18,6 +25,23 @@ st.title("Optimizador de Producción y Precios — Comparativa de empresas (Simp
 # ============================================
 # UTILIDAD PARA PARSEAR JSON DE EMPRESAS
 # ============================================
+def loads_json(raw):
+    """
+    Parsea JSON con orjson si está disponible. orjson rechaza NaN, Infinity
+    y enteros de más de 64 bits; en ese caso se reintenta con json estándar.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+# Las funciones de datos se cachean con st.cache_data: Streamlit re-ejecuta
+# el script completo en cada interacción y los resultados solo dependen
+# de las entradas.
+@st.cache_data
 def parse_companies_from_json(raw_json):
     """
     Espera JSON con estructura:
@@ -31,7 +55,7 @@ def parse_companies_from_json(raw_json):
       ]
     }
     """
-    j = json.loads(raw_json)
+    j = loads_json(raw_json)
     companies = []
 
     for comp in j.get("companies", []):
@@ -39,106 +63,240 @@ def parse_companies_from_json(raw_json):
         mats = comp.get("materials", [])
         mat_df = pd.DataFrame(mats)
 
-        # Productos
+        # Productos: columnas escalares + una columna por materia consumida
         prods = comp.get("products", [])
-        prod_rows = []
-        for p in prods:
-            row = {
-                "name": p.get("name"),
-                "unit_cost": float(p.get("unit_cost", 0.0)),
-                "demand": p.get("demand_a", None),
-                "demand_b": p.get("demand_b", None),
-                "price_min": p.get("price_min", None),
-                "price_max": p.get("price_max", None)
-            }
-            # consumos por materia
-            materials_consumption = p.get("materials", {}) or {}
-            for mname, mval in materials_consumption.items():
-                row[mname] = float(mval)
-            prod_rows.append(row)
-
-        prod_df = pd.DataFrame(prod_rows)
+        scalars = {
+            "name": [p.get("name") for p in prods],
+            "unit_cost": [float(p.get("unit_cost", 0.0)) for p in prods],
+            "demand": [p.get("demand_a", None) for p in prods],
+            "demand_b": [p.get("demand_b", None) for p in prods],
+            "price_min": [p.get("price_min", None) for p in prods],
+            "price_max": [p.get("price_max", None) for p in prods]
+        }
+
+        # consumos por materia (en orden de aparición)
+        consumptions = [p.get("materials", {}) or {} for p in prods]
+        mat_cols = list(dict.fromkeys(m for cons in consumptions for m in cons))
+        col_index = {m: k for k, m in enumerate(mat_cols)}
+        mats_arr = np.zeros((len(prods), len(mat_cols)))
+        for i, cons in enumerate(consumptions):
+            for mname, mval in cons.items():
+                mats_arr[i, col_index[mname]] = float(mval)
+
+        prod_df = pd.concat(
+            [pd.DataFrame(scalars), pd.DataFrame(mats_arr, columns=mat_cols)],
+            axis=1
+        )
+
+        # Un dato numérico inválido solo invalida a esta empresa
+        try:
+            arrays = build_company_arrays(mat_df, prod_df)
+        except (TypeError, ValueError):
+            arrays = None
 
         companies.append({
             "name": comp.get("name", "Empresa"),
             "materials_df": mat_df,
             "products_df": prod_df,
+            "arrays": arrays,
             "raw": comp
         })
 
     return companies
 
 
-# ============================================
-# UTILIDAD PARA CONSTRUIR PROBLEMA LP
-# ============================================
-def build_lp_problem(materials_df, products_df, price_mode="promedio", override_profit=None):
+def build_company_arrays(materials_df, products_df):
     """
-    Construye los coeficientes para linprog.
-    price_mode ∈ {promedio, min, max}
+    Convierte las tablas de una empresa a arreglos numpy contiguos (float64),
+    listos para las funciones de LP. Los DataFrames quedan solo para la UI.
+
+    M[j, i] = consumo de la materia j por unidad del producto i.
+    pmin, pmax y demand conservan NaN donde el dato no existe.
     """
     # Materias primas
-    mat_names = materials_df["name"].tolist()
+    mat_names = materials_df.get("name", pd.Series(dtype=object)).tolist()
     if "available" in materials_df.columns:
-        b = materials_df["available"].to_numpy(dtype=float)
+        avail = materials_df["available"].to_numpy(dtype=float)
     elif "Disponibilidad" in materials_df.columns:
-        b = materials_df["Disponibilidad"].to_numpy(dtype=float)
+        avail = materials_df["Disponibilidad"].to_numpy(dtype=float)
+    elif len(materials_df.columns) > 1:
+        avail = materials_df.iloc[:, 1].to_numpy(dtype=float)
+    elif mat_names:
+        raise ValueError("las materias primas no indican disponibilidad")
     else:
-        b = materials_df.iloc[:, 1].to_numpy(dtype=float)
+        avail = np.zeros(0)
 
     # Productos
-    prod_names = products_df["name"].tolist()
+    prod_names = products_df.get("name", pd.Series(dtype=object)).tolist()
     n = len(prod_names)
 
-    # Matriz A de consumos
-    A = []
-    for m in mat_names:
-        if m in products_df.columns:
-            A.append(products_df[m].fillna(0).to_numpy(dtype=float))
-        else:
-            A.append(np.zeros(n))
-    A = np.array(A)
+    # Columnas de productos como arreglos (columnas ausentes => NaN)
+    missing = pd.Series([np.nan] * n)
+    demand = products_df.get("demand", missing).to_numpy(dtype=float)
+    demand_b = products_df.get("demand_b", missing).to_numpy(dtype=float)
+
+    # Matriz de consumos preasignada; se escribe fila por fila
+    M = np.zeros((len(mat_names), n), dtype=np.float64)
+    for j, name in enumerate(mat_names):
+        if name in products_df.columns:
+            M[j] = products_df[name].to_numpy(dtype=float, na_value=0.0)
+
+    return {
+        "mat_names": mat_names,
+        "prod_names": prod_names,
+        "M": M,
+        "uc": products_df.get("unit_cost", missing).fillna(0.0).to_numpy(dtype=float),
+        "a": np.nan_to_num(demand, nan=0.0),
+        "b": np.nan_to_num(demand_b, nan=0.0),
+        "avail": avail,
+        "pmin": products_df.get("price_min", missing).to_numpy(dtype=float),
+        "pmax": products_df.get("price_max", missing).to_numpy(dtype=float),
+        "demand": demand,
+    }
 
-    # Ganancias
-    profits = np.zeros(n)
-    for i in range(n):
-        row = products_df.iloc[i]
-        unit_cost = float(row.get("unit_cost", 0.0))
 
-        if override_profit is not None:
-            profits[i] = float(override_profit[i])
+# ============================================
+# UTILIDAD PARA CONSTRUIR PROBLEMA LP
+# ============================================
+@st.cache_data
+def build_lp_problem(arrays, price_mode="promedio", override_profit=None):
+    """
+    Construye los coeficientes para linprog a partir de build_company_arrays.
+    price_mode ∈ {promedio, min, max}
+    """
+    if arrays is None:
+        raise ValueError("la empresa tiene datos numéricos inválidos")
+
+    unit_cost = arrays["uc"]
+    pmin = arrays["pmin"]
+    pmax = arrays["pmax"]
+
+    # Ganancias
+    if override_profit is not None:
+        profits = np.asarray(override_profit, dtype=float)
+    else:
+        # Si falta un extremo del rango (ausente o 0, como antes) se usa el otro
+        no_min = np.isnan(pmin) | (pmin == 0)
+        no_max = np.isnan(pmax) | (pmax == 0)
+        lo = np.where(no_min, pmax, pmin)
+        hi = np.where(no_max, pmin, pmax)
+
+        if price_mode == "promedio":
+            price = 0.5 * (lo + hi)
+        elif price_mode == "min":
+            price = lo
         else:
-            pmin = row.get("price_min")
-            pmax = row.get("price_max")
-
-            if pmin is None and pmax is None:
-                profits[i] = -unit_cost
-            else:
-                if price_mode == "promedio":
-                    price = ((pmin if pmin else pmax) + (pmax if pmax else pmin)) / 2
-                elif price_mode == "min":
-                    price = pmin if pmin else pmax
-                else:
-                    price = pmax if pmax else pmin
-                profits[i] = price - unit_cost
+            price = hi
+
+        profits = np.where(no_min & no_max, -unit_cost, price - unit_cost)
 
     # Bounds por producto
-    bounds = []
-    for i in range(n):
-        d = products_df.iloc[i].get("demand")
-        if d is None:
-            bounds.append((0, None))
-        else:
-            bounds.append((0, float(d)))
+    bounds = [(0, None if np.isnan(d) else float(d)) for d in arrays["demand"]]
 
     # linprog minimiza => usamos -profits para maximizar
     c = -profits
 
-    return c, A, b, bounds, prod_names, profits, mat_names
+    return (c, arrays["M"], arrays["avail"], bounds,
+            arrays["prod_names"], profits, arrays["mat_names"])
 
 
+def run_linprog(c, A, b, bounds):
+    """
+    Resuelve el LP con HiGHS. Sin caché de Streamlit: se puede llamar desde
+    hilos de trabajo que no tienen contexto de ejecución del script.
+    """
+    # Cada producto usa pocas materias: con A dispersa HiGHS usa su ruta sparse
+    A_ub = csr_matrix(A) if A.size and (A == 0).mean() > 0.4 else A
+    res = linprog(c=c, A_ub=A_ub, b_ub=b, bounds=bounds, method="highs-ds")
+    if res.status == 4:
+        # Dificultades numéricas: dejar que HiGHS elija el método
+        res = linprog(c=c, A_ub=A_ub, b_ub=b, bounds=bounds, method="highs")
+    return res
+
+
+def solve_one(problem):
+    """
+    Resuelve un LP (c, A, b, bounds) sin caché, apto para hilos de trabajo.
+    Retorna la solución x, o None si falla o no hay óptimo.
+    """
+    try:
+        res = run_linprog(*problem)
+        return res.x if res.success else None
+    except Exception:
+        return None
+
+
+@st.cache_data
 def solve_lp(c, A, b, bounds):
-    return linprog(c=c, A_ub=A, b_ub=b, bounds=bounds, method="highs")
+    return run_linprog(c, A, b, bounds)
+
+
+# Mínimo de empresas para resolver la comparativa como un único LP
+BATCH_MIN_COMPANIES = 3
+# Máximo de hilos para resolver empresas en paralelo
+MAX_SOLVER_THREADS = 8
+
+
+@st.cache_data
+def solve_lp_batch(problems):
+    """
+    Resuelve varios LP independientes (c, A, b, bounds) como un único
+    problema bloque-diagonal, pagando una sola vez el arranque de HiGHS.
+    Retorna la lista de soluciones x por problema, o None si el problema
+    conjunto no tiene óptimo (p.ej. alguna empresa es infactible) o si
+    los datos de alguna empresa son inválidos (p.ej. disponibilidad NaN).
+    """
+    try:
+        c = np.hstack([p[0] for p in problems])
+        A = block_diag([csr_matrix(p[1]) for p in problems], format="csr")
+        b = np.hstack([p[2] for p in problems])
+        bounds = [bnd for p in problems for bnd in p[3]]
+        res = linprog(c=c, A_ub=A, b_ub=b, bounds=bounds, method="highs-ds")
+    except Exception:
+        return None
+    if not res.success:
+        return None
+
+    splits = np.cumsum([len(p[0]) for p in problems])[:-1]
+    return np.split(res.x, splits)
+
+
+def solve_for_company(company, price_mode, override_profit=None):
+    """
+    Construye y resuelve el LP de una empresa. El resultado se memoriza en
+    st.session_state["lp_cache"] para que la optimización individual y la
+    comparativa con FlexSim no resuelvan dos veces el mismo problema.
+    Retorna (salida de build_lp_problem, resultado de linprog).
+    """
+    key = (company["name"], price_mode,
+           tuple(override_profit) if override_profit is not None else None)
+    lp_cache = st.session_state.setdefault("lp_cache", {})
+    if key not in lp_cache:
+        lp = build_lp_problem(company["arrays"], price_mode=price_mode,
+                              override_profit=override_profit)
+        lp_cache[key] = (lp, solve_lp(*lp[:4]))
+    return lp_cache[key]
+
+
+def lp_signature(c, A, b, bounds):
+    """Huella de los datos de un LP, para reutilizar soluciones previas."""
+    return (c.tobytes(), A.shape, A.tobytes(), b.tobytes(), tuple(bounds))
+
+
+# ============================================
+# UTILIDAD PARA CARGAR DATOS DE FLEXSIM
+# ============================================
+@st.cache_resource
+def load_flex_data(path="sample_data.json"):
+    """
+    Lee sample_data.json una sola vez por proceso.
+    Retorna el DataFrame de 'flexsim', o None si falta la clave.
+    """
+    with open(path, "rb") as f:
+        flex_data = loads_json(f.read())
+    if "flexsim" not in flex_data:
+        return None
+    return pd.DataFrame(flex_data["flexsim"])
 
 
 # ============================================
@@ -214,7 +372,7 @@ EXAMPLE_JSON = """
 # Selección de fuente JSON
 raw_json = None
 if uploaded_file:
-    raw_json = uploaded_file.read().decode("utf-8")
+    raw_json = uploaded_file.read()
 elif raw_json_text.strip() != "":
     raw_json = raw_json_text
 elif example_data:
@@ -234,6 +392,11 @@ except Exception as e:
     st.error(f"Error al parsear JSON: {e}")
     st.stop()
 
+# Las soluciones memorizadas solo valen para el JSON con que se obtuvieron
+if st.session_state.get("lp_cache_source") != hash(raw_json):
+    st.session_state["lp_cache_source"] = hash(raw_json)
+    st.session_state["lp_cache"] = {}
+
 # Selector empresa
 company_names = [c["name"] for c in companies]
 selected = st.sidebar.selectbox("Seleccione empresa", company_names)
@@ -269,18 +432,15 @@ st.markdown("---")
 if st.button("Ejecutar optimización (empresa seleccionada)"):
 
     try:
-        c, A, b, bounds, prod_names, profits, mat_names = build_lp_problem(
-            company["materials_df"], company["products_df"],
-            price_mode=price_mode, override_profit=override_profit
-        )
-        res = solve_lp(c, A, b, bounds)
+        lp, res = solve_for_company(company, price_mode, override_profit)
+        c, A, b, bounds, prod_names, profits, mat_names = lp
 
         if not res.success:
             st.error("No se encontró solución óptima.")
             st.write(res.message)
             st.stop()
 
-        production = np.round(res.x, 6)
+        production = res.x
         total_profit = float(np.dot(profits, production))
 
         st.success("Optimización resuelta.")
@@ -290,7 +450,10 @@ if st.button("Ejecutar optimización (empresa seleccionada)"):
             "Ganancia unitaria": profits,
             "Contribución total": profits * production
         })
-        st.dataframe(results_df)
+        st.dataframe(results_df.style.format({
+            "Cantidad óptima": "{:.6f}",
+            "Contribución total": "{:.2f}"
+        }))
 
         st.metric("Ganancia total", f"${total_profit:,.2f}")
 
@@ -312,41 +475,77 @@ if st.button("Ejecutar comparativa general"):
     summary = []
     details = []
 
+    # Construir el LP de cada empresa (None si falla)
+    problems = []
     for comp in companies:
         try:
-            c, A, b, bounds, prod_names, profits, mat_names = build_lp_problem(
-                comp["materials_df"], comp["products_df"], price_mode=price_mode
-            )
-            res = solve_lp(c, A, b, bounds)
-
-            if res.success:
-                production = np.round(res.x, 6)
-                total_profit = float(np.dot(profits, production))
-
-                summary.append({
-                    "Empresa": comp["name"],
-                    "Ganancia": total_profit,
-                    "Producción total": float(production.sum())
-                })
-
-                details.append({
-                    "Empresa": comp["name"],
-                    "Productos": prod_names,
-                    "Producción óptima": production.tolist()
-                })
-            else:
-                summary.append({
-                    "Empresa": comp["name"],
-                    "Ganancia": None,
-                    "Producción total": None
-                })
-
-        except:
+            problems.append(build_lp_problem(
+                comp["arrays"], price_mode=price_mode
+            ))
+        except Exception:
+            problems.append(None)
+
+    # HiGHS en scipy no acepta una base inicial, así que la "reanudación" es
+    # reutilizar la última solución de cada empresa cuyo LP no cambió.
+    last_solutions = st.session_state.setdefault("last_lp_solutions", {})
+    solutions = [None] * len(companies)
+    signatures = {}
+    stale = []
+    for i, prob in enumerate(problems):
+        if prob is None:
+            continue
+        signatures[i] = lp_signature(*prob[:4])
+        cached = last_solutions.get(companies[i]["name"])
+        if cached is not None and cached[0] == signatures[i]:
+            solutions[i] = cached[1]
+        else:
+            stale.append(i)
+
+    # Resolver: en bloque si hay suficientes empresas, si no una por una
+    batch = None
+    if len(stale) >= BATCH_MIN_COMPANIES:
+        batch = solve_lp_batch([problems[i][:4] for i in stale])
+    if batch is not None:
+        for i, x in zip(stale, batch):
+            solutions[i] = x
+    elif len(stale) == 1:
+        solutions[stale[0]] = solve_one(problems[stale[0]][:4])
+    elif stale:
+        # Los LP son independientes: resolverlos en paralelo
+        workers = min(MAX_SOLVER_THREADS, len(stale))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            stale_problems = [problems[i][:4] for i in stale]
+            for i, x in zip(stale, ex.map(solve_one, stale_problems)):
+                solutions[i] = x
+
+    for i in stale:
+        if solutions[i] is not None:
+            last_solutions[companies[i]["name"]] = (signatures[i], solutions[i])
+
+    for comp, prob, x in zip(companies, problems, solutions):
+        if x is None:
             summary.append({
                 "Empresa": comp["name"],
                 "Ganancia": None,
                 "Producción total": None
             })
+            continue
+
+        prod_names, profits = prob[4], prob[5]
+        production = x
+        total_profit = float(np.dot(profits, production))
+
+        summary.append({
+            "Empresa": comp["name"],
+            "Ganancia": total_profit,
+            "Producción total": float(production.sum())
+        })
+
+        details.append({
+            "Empresa": comp["name"],
+            "Productos": prod_names,
+            "Producción óptima": production.tolist()
+        })
 
     df_summary = pd.DataFrame(summary)
     st.dataframe(df_summary)
@@ -360,7 +559,7 @@ if st.button("Ejecutar comparativa general"):
         st.dataframe(pd.DataFrame({
             "Producto": d["Productos"],
             "Producción óptima": d["Producción óptima"]
-        }))
+        }).style.format({"Producción óptima": "{:.6f}"}))
 
 
 # ============================================
@@ -370,32 +569,28 @@ st.markdown("---")
 st.subheader("Comparativa Optimizer vs FlexSim")
 
 try:
-    with open("sample_data.json", "r") as f:
-        flex_data = json.load(f)
+    df_flex = load_flex_data()
 except Exception as e:
     st.error(f"No se pudo cargar sample_data.json: {e}")
     st.stop()
 
-if "flexsim" not in flex_data:
+if df_flex is None:
     st.error("sample_data.json debe contener la clave 'flexsim'")
     st.stop()
 
-df_flex = pd.DataFrame(flex_data["flexsim"])
 st.write("**Datos reales (FlexSim):**")
 st.dataframe(df_flex)
 
 # Resolver optimizador para misma empresa
 try:
-    c, A, b, bounds, prod_names, profits, mat_names = build_lp_problem(
-        company["materials_df"], company["products_df"], price_mode=price_mode
-    )
-    res = solve_lp(c, A, b, bounds)
+    lp, res = solve_for_company(company, price_mode)
+    c, A, b, bounds, prod_names, profits, mat_names = lp
 
     if not res.success:
         st.error("No se pudo resolver optimización para comparativa.")
         st.stop()
 
-    production_opt = np.round(res.x, 6)
+    production_opt = res.x
 
     df_opt = pd.DataFrame({
         "Producto": prod_names,
@@ -403,14 +598,21 @@ try:
     })
 
     st.write("**Resultados del Optimizer (Simplex):**")
-    st.dataframe(df_opt)
+    st.dataframe(df_opt.style.format({"Producción óptima": "{:.6f}"}))
 
     # Comparativa
-    df_cmp = df_opt.merge(df_flex, on="Producto", how="inner")
+    # Si FlexSim repite un producto, vale el último registro
+    flex_map = (df_flex.drop_duplicates("Producto", keep="last")
+                .set_index("Producto")["real_production"])
+    df_cmp = df_opt.assign(real_production=df_opt["Producto"].map(flex_map))
+    df_cmp = df_cmp.dropna(subset=["real_production"])
     df_cmp["Diferencia"] = df_cmp["Producción óptima"] - df_cmp["real_production"]
 
     st.subheader("Comparativa final")
-    st.dataframe(df_cmp)
+    st.dataframe(df_cmp.style.format({
+        "Producción óptima": "{:.6f}",
+        "Diferencia": "{:.6f}"
+    }))
 
     fig = px.bar(df_cmp, x="Producto",
                  y=["Producción óptima", "real_production"],
@@ -1,6 +1,11 @@
 # optimizer.py
 import numpy as np
-from scipy.optimize import linprog, minimize
+from scipy.optimize import LinearConstraint, linprog, minimize
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional
+    njit = None
 
 """
 MÓDULO PROFESIONAL DE OPTIMIZACIÓN
@@ -17,83 +22,112 @@ Produce:
 
 
 # -------------------------------------------------------
-# 1. OPTIMIZACIÓN DE CANTIDADES (Simplex)
+# 0. MATRIZ DE CONSUMOS
 # -------------------------------------------------------
-def solve_quantity_lp(products, materials, prices):
-    n = len(products)
+def _build_consumption_matrix(products, materials):
+    """
+    Retorna (M, mat_names) con M[j, i] = consumo del material j
+    por unidad del producto i.
+    """
+    mat_names = [mat["name"] for mat in materials]
+    M = np.zeros((len(mat_names), len(products)))
+    for i, prod in enumerate(products):
+        consumption = prod.get("materials", {}) or {}
+        for j, name in enumerate(mat_names):
+            M[j, i] = consumption.get(name, 0.0)
+    return M, mat_names
 
-    c = []
-    bounds = []
 
-    for i, prod in enumerate(products):
-        profit_u = prices[i] - prod["unit_cost"]
-        c.append(-profit_u)
+def _pack(products, materials):
+    """
+    Empaqueta productos y materiales en arreglos numpy:
+    (uc, a, b, M, avail, mat_names)
+    """
+    uc = np.array([prod["unit_cost"] for prod in products], dtype=float)
+    a = np.array([prod.get("demand_a", 0) for prod in products], dtype=float)
+    b = np.array([prod.get("demand_b", 0) for prod in products], dtype=float)
+    M, mat_names = _build_consumption_matrix(products, materials)
+    avail = np.array([mat["available"] for mat in materials], dtype=float)
+    return uc, a, b, M, avail, mat_names
 
-        a = prod.get("demand_a", 0)
-        b = prod.get("demand_b", 0)
-        demand_cap = max(0.0, a - b * prices[i])
 
-        bounds.append((0, demand_cap))
+# -------------------------------------------------------
+# 1. OPTIMIZACIÓN DE CANTIDADES (Simplex)
+# -------------------------------------------------------
+def solve_quantity_lp(products, materials, prices):
+    uc, a, b, M, avail, mat_names = _pack(products, materials)
+    prices = np.asarray(prices, dtype=float)
 
-    A = []
-    b_vec = []
-    for mat in materials:
-        row = []
-        for prod in products:
-            row.append(prod.get("materials", {}).get(mat["name"], 0))
-        A.append(row)
-        b_vec.append(mat["available"])
+    c = -(prices - uc)
+    demand_cap = np.maximum(0.0, a - b * prices)
+    bounds = [(0, cap) for cap in demand_cap]
 
-    res = linprog(c=np.array(c), A_ub=np.array(A), b_ub=np.array(b_vec),
+    res = linprog(c=c, A_ub=M, b_ub=avail,
                   bounds=bounds, method="highs")
 
     if not res.success:
         return {"success": False, "message": res.message}
 
     x = res.x
-    total_profit = sum((prices[i] - products[i]["unit_cost"]) * x[i] for i in range(n))
+    total_profit = float(np.dot(prices - uc, x))
 
     return {
         "success": True,
         "quantities": x,
         "profit": total_profit,
         "message": res.message,
-        "material_usage": compute_material_usage(products, materials, x)
+        "material_usage": compute_material_usage(products, materials, x,
+                                                 consumption=(M, mat_names))
     }
 
 
 # -------------------------------------------------------
 # 2. FUNCIÓN DE GANANCIA → PARA OPTIMIZACIÓN DE PRECIOS
 # -------------------------------------------------------
-def profit_for_prices(prices, products, materials):
-    n = len(products)
-    qs = np.zeros(n)
-
-    for i, p in enumerate(prices):
-        a = products[i].get("demand_a", 0)
-        b = products[i].get("demand_b", 0)
-        qs[i] = max(0, a - b * p)
-
-    profit = sum((prices[i] - products[i]["unit_cost"]) * qs[i] for i in range(n))
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _profit_for_prices_nb(prices, uc, a, b):
+        profit = 0.0
+        for i in range(prices.size):
+            qi = a[i] - b[i] * prices[i]
+            if qi < 0.0:
+                qi = 0.0
+            profit += (prices[i] - uc[i]) * qi
+        return -profit
+
+    # Compila (o carga de la caché) al importar el módulo
+    _profit_for_prices_nb(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1))
+else:
+    _profit_for_prices_nb = None
+
+
+def profit_for_prices(prices, packed):
+    """
+    Ganancia negativa (para minimizar). Las restricciones de materiales
+    no se penalizan aquí: optimize_prices las pasa como LinearConstraint.
+    """
+    uc, a, b = packed[:3]
+    if _profit_for_prices_nb is not None:
+        return _profit_for_prices_nb(np.asarray(prices, dtype=float), uc, a, b)
 
-    penalties = 0
-    for mat in materials:
-        usage = 0
-        for i, prod in enumerate(products):
-            usage += prod.get("materials", {}).get(mat["name"], 0) * qs[i]
+    q = np.maximum(0.0, a - b * prices)
+    return -float(np.dot(prices - uc, q))
 
-        if usage > mat["available"]:
-            penalties += 1e6 * (usage - mat["available"])
 
-    return -profit + penalties
+def _grad(prices, packed):
+    """Gradiente analítico de profit_for_prices."""
+    uc, a, b = packed[:3]
+    q = np.maximum(0.0, a - b * prices)
+    # En el precio de corte (q = 0) se usa la derivada por la izquierda,
+    # para que el optimizador no se detenga en ese punto
+    dq = np.where(a - b * prices >= 0, -b, 0.0)
+    return -(q + (prices - uc) * dq)
 
 
 # -------------------------------------------------------
 # 3. OPTIMIZACIÓN DE PRECIOS
 # -------------------------------------------------------
 def optimize_prices(products, materials, price_bounds=None, x0=None):
-    n = len(products)
-
     if price_bounds is None:
         price_bounds = []
         for prod in products:
@@ -101,44 +135,92 @@ def optimize_prices(products, materials, price_bounds=None, x0=None):
             mx = prod.get("price_max", prod.get("demand_a", 1000))
             price_bounds.append((mn, mx))
 
-    if x0 is None:
-        x0 = np.array([(mn + mx) / 2 for mn, mx in price_bounds])
-
-    res = minimize(lambda p: profit_for_prices(p, products, materials),
-                   x0, bounds=price_bounds, method="L-BFGS-B")
-
-    if not res.success:
-        return {"success": False, "message": res.message}
-
-    prices_opt = res.x
-    qs = np.array([
-        max(0, prod.get("demand_a", 0) - prod.get("demand_b", 0) * prices_opt[i])
-        for i, prod in enumerate(products)
-    ])
-
-    total_profit = sum((prices_opt[i] - products[i]["unit_cost"]) * qs[i] for i in range(n))
+    packed = _pack(products, materials)
+    uc, a, b, M, avail, mat_names = packed
+    # Cota None (convención de scipy) => sin límite
+    lo, hi = np.array(price_bounds, dtype=float).T
+    lo = np.where(np.isnan(lo), -np.inf, lo)
+    hi = np.where(np.isnan(hi), np.inf, hi)
+
+    # Sin materiales activos el problema se separa por producto:
+    # max (p - uc) * (a - b p)  =>  p* = (a / b + uc) / 2, recortado al rango
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_star = np.where(b > 0, 0.5 * (a / b + uc), hi)
+    p_star = np.clip(p_star, lo, hi)
+
+    # Con b == 0 la demanda no depende del precio: sin tope superior la
+    # ganancia no está acotada; sin demanda el precio es indiferente.
+    unbounded = ~np.isfinite(p_star)
+    if np.any(unbounded & (a > 0)):
+        return {"success": False,
+                "message": "Ganancia no acotada: falta precio máximo con demand_b = 0"}
+    p_star = np.where(unbounded, np.clip(uc, lo, hi), p_star)
+    q_star = np.maximum(0.0, a - b * p_star)
+
+    if np.all(M @ q_star <= avail):
+        prices_opt = p_star
+    else:
+        # Algún material se excede. Por encima de a/b la demanda es 0, así
+        # que se limita el precio a a/b: en ese rango q = a - b p es lineal
+        # y el uso de materiales M @ q <= avail es una restricción lineal.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            choke = np.where(b > 0, a / b, np.inf)
+        hi = np.maximum(lo, np.minimum(hi, choke))
+
+        # Demanda en los extremos del rango (b == 0 => demanda constante a)
+        with np.errstate(invalid="ignore"):
+            q_lo = np.where(b > 0, a - b * lo, a)
+            q_hi = np.maximum(0.0, np.where(b > 0, a - b * hi, a))
+
+        # Productos sin demanda en todo el rango no consumen materiales
+        M_eff = M * (q_lo > 0)
+
+        if np.any(M @ q_hi > avail):
+            return {"success": False,
+                    "message": "Materiales insuficientes aun con precios máximos"}
+
+        materials_lc = LinearConstraint(-M_eff * b, -np.inf, avail - M_eff @ a)
+
+        if x0 is None:
+            x0 = p_star
+
+        res = minimize(lambda p: profit_for_prices(p, packed), np.clip(x0, lo, hi),
+                       jac=lambda p: _grad(p, packed),
+                       bounds=list(zip(lo, hi)), constraints=[materials_lc],
+                       method="SLSQP")
+
+        if not res.success:
+            return {"success": False, "message": res.message}
+
+        prices_opt = res.x
+
+    qs = np.maximum(0.0, a - b * prices_opt)
+
+    total_profit = float(np.dot(prices_opt - uc, qs))
 
     return {
         "success": True,
         "prices": prices_opt,
         "quantities": qs,
         "profit": total_profit,
-        "material_usage": compute_material_usage(products, materials, qs)
+        "material_usage": compute_material_usage(products, materials, qs,
+                                                 consumption=(M, mat_names))
     }
 
 
 # -------------------------------------------------------
 # 4. COMPUTA USO DE MATERIALES
 # -------------------------------------------------------
-def compute_material_usage(products, materials, quantities):
-    usage = {}
-    for mat in materials:
-        name = mat["name"]
-        total_use = 0
-        for i, prod in enumerate(products):
-            total_use += prod.get("materials", {}).get(name, 0) * quantities[i]
-        usage[name] = total_use
-    return usage
+def compute_material_usage(products, materials, quantities, consumption=None):
+    """
+    consumption: (M, mat_names) ya construido con _build_consumption_matrix,
+    para no reconstruir la matriz en cada llamada.
+    """
+    if consumption is None:
+        consumption = _build_consumption_matrix(products, materials)
+    M, mat_names = consumption
+    usage_vec = M @ np.asarray(quantities, dtype=float)
+    return dict(zip(mat_names, usage_vec.tolist()))
 
 
 # -------------------------------------------------------